@@ -1,4 +1,10 @@
+import functools
+import math
+import operator
 import sys
+
+# parse, find_dynamic and compile_expr recurse once per level of nesting in
+# the source; run-time Scheme calls do not use the Python stack
 sys.setrecursionlimit(20_000)
 
 class SchemeError(Exception):
@@ -41,19 +47,34 @@ class SchemeEvaluationError(SchemeError):
 ############################
 
 
+BOOLEANS = {"#t": True, "#f": False}
+
+
 def number_or_symbol(value):
     """
-    Helper function: given a string, convert it to an integer or a float if
-    possible; otherwise, return the string itself
+    Helper function: given a string, convert it to a boolean (for #t and #f),
+    an integer or a float if possible; otherwise, return the string itself,
+    interned so that name lookups can compare symbols by identity
     
     """
+    if value in BOOLEANS:
+        return BOOLEANS[value]
     try:
         return int(value)
     except ValueError:
         try:
             return float(value)
         except ValueError:
-            return value
+            return sys.intern(value)
+
+
+# pads parentheses with spaces so that str.split separates them
+PAREN_TABLE = str.maketrans({"(": " ( ", ")": " ) "})
+
+
+def remove_comment(line):
+    ind = line.find(";")
+    return line if ind < 0 else line[:ind]
 
 
 def tokenize(source):
@@ -66,17 +87,8 @@ def tokenize(source):
                       expression
     """
     res = []
-    lines = source.split("\n")
-    for line in lines:
-        token = ""
-        for word in line:
-            if word == ";":
-                break
-            if word in "()":
-                token += " " + word + " "
-            else:
-                token += word
-        res.extend(token.split())
+    for line in source.split("\n"):
+        res.extend(remove_comment(line).translate(PAREN_TABLE).split())
     return res
 
 
@@ -90,38 +102,29 @@ def parse(tokens):
     Arguments:
         tokens (list): a list of strings representing tokens
     """
-    if len(tokens) == 1:
-        if tokens[0] in "()":
+    if not tokens:
+        return []
+
+    def parse_from(i):
+        """parse the expression starting at tokens[i]; return it and the index
+        of the token after it"""
+        if tokens[i] == "(":
+            result = []
+            i += 1
+            while i < len(tokens) and tokens[i] != ")":
+                val, i = parse_from(i)
+                result.append(val)
+            if i == len(tokens):
+                raise SchemeSyntaxError(tokens)
+            return result, i + 1
+        if tokens[i] == ")":
             raise SchemeSyntaxError
-        return number_or_symbol(tokens[0])
-    if len(tokens) > 1 and (tokens[0] != "(" or tokens[-1] != ")"):
-        raise SchemeSyntaxError(tokens)
+        return number_or_symbol(tokens[i]), i + 1
 
-    def get_ind(s):
-        num_open, num_close = 1, 0
-        for i in range(s + 1, len(tokens) - 1):
-            if tokens[i] == "(":
-                num_open += 1
-            elif tokens[i] == ")":
-                num_close += 1
-            if num_close == num_open:
-                return i
-        raise SchemeSyntaxError
-
-    def parse_tok(s, e):
-        result = []
-        while s < e:
-            if tokens[s] not in "()":
-                result.append(number_or_symbol(tokens[s]))
-                s += 1
-            elif tokens[s] == "(":
-                result.append(parse_tok(s + 1, get_ind(s)))
-                s = get_ind(s) + 1
-            else:
-                raise SchemeSyntaxError
-        return result
-
-    return parse_tok(1, len(tokens) - 1)
+    result, end = parse_from(0)
+    if end != len(tokens):
+        raise SchemeSyntaxError(tokens)
+    return result
 
 
 ######################
@@ -130,63 +133,90 @@ def parse(tokens):
 
 
 class Pair:
+    __slots__ = ("car", "cdr")
+
     def __init__(self, car, cdr):
         self.car = car
         self.cdr = cdr
 
 
+class VList(Pair):
+    """
+    The first Pair of a list built by list.  The list is an ordinary chain
+    of Pairs, so car and cdr cost nothing extra, but the head also keeps
+    all the elements in the Python list data, so that length and list-ref
+    on the whole list need not walk it.  data is a copy that make_list
+    owns, so it never changes.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, car, cdr, data):
+        self.car = car
+        self.cdr = cdr
+        self.data = data
+
+
 null = None
 
 
+def numbers(args):
+    # True and False are Python ints, but #t and #f are not Scheme numbers
+    for arg in args:
+        if arg.__class__ is bool:
+            raise SchemeEvaluationError(arg)
+    return args
+
+
+def add(args):
+    return sum(numbers(args))
+
+
+def subtract(args):
+    numbers(args)
+    return -args[0] if len(args) == 1 else (args[0] - sum(args[1:]))
+
+
 def multiply(args):
-    res = 1
-    for i in args:
-        res *= i
-    return res
+    return math.prod(numbers(args))
 
 
 def divide(args):
-    return args[0] if len(args) == 1 else args[0] / multiply(args[1:])
+    numbers(args)
+    return args[0] if len(args) == 1 else args[0] / math.prod(args[1:])
 
 
-comparison = {
-    "equal?": lambda x, y: x == y,
-    "<=": lambda x, y: x <= y,
-    ">=": lambda x, y: x >= y,
-    ">": lambda x, y: x > y,
-    "<": lambda x, y: x < y,
-}
+def equal(x, y):
+    # True == 1 in Python, but #t and 1 are different Scheme values
+    return x == y and isinstance(x, bool) == isinstance(y, bool)
 
 
-def compare(func, arg, frame):
-    func = comparison[func]
-    for i in range(0, len(arg) - 1):
-        if not func(evaluate(arg[i], frame), evaluate(arg[i + 1], frame)):
-            return "#f"
-    return "#t"
+def ordering(operation):
+    """operation on two numbers, refusing #t and #f as equal? does"""
 
+    def func(x, y):
+        if x.__class__ is bool or y.__class__ is bool:
+            raise SchemeEvaluationError((x, y))
+        return operation(x, y)
 
-def combinator(combi, arg, frame):
-    """and or not"""
-    if combi == "not":
-        if len(arg) != 1:
-            raise SchemeEvaluationError
-        return "#t" if evaluate(arg[0], frame) == "#f" else "#f"
-    if combi == "and":
-        for val in arg:
-            if evaluate(val, frame) == "#f":
-                return "#f"
-        return "#t"
-    for val in arg:
-        if evaluate(val, frame) == "#t":
-            return "#t"
-    return "#f"
+    return func
 
 
-def condition(pred, t, f, frame):
-    if evaluate(pred, frame) == "#t":
-        return evaluate(t, frame)
-    return evaluate(f, frame)
+comparison = {
+    "equal?": equal,
+    "<=": ordering(operator.le),
+    ">=": ordering(operator.ge),
+    ">": ordering(operator.gt),
+    "<": ordering(operator.lt),
+}
+comparison = {sys.intern(name): func for name, func in comparison.items()}
+
+
+def compare(func, args):
+    for i in range(0, len(args) - 1):
+        if not func(args[i], args[i + 1]):
+            return False
+    return True
 
 
 def cons(p1, p2):
@@ -206,71 +236,95 @@ def get_cdr(arg):
 
 
 def make_list(arg):
-    def make(ind):
-        if ind + 1 > len(arg):
-            return null
-        return Pair(arg[ind], make(ind + 1))
+    if not arg:
+        return null
+    arg = list(arg)  # the caller's list may change later; data must not
+    tail = null
+    for ind in range(len(arg) - 1, 0, -1):
+        tail = Pair(arg[ind], tail)
+    return VList(arg[0], tail, arg)
+
 
-    return make(0)
+def list_items(ll):
+    """the elements of the proper list ll, as a Python list"""
+    items = []
+    while ll is not null:
+        if isinstance(ll, VList):
+            items.extend(ll.data)
+            break
+        items.append(ll.car)
+        ll = ll.cdr
+    return items
 
 
 def is_list(arg):
-    if not isinstance(arg, Pair) and arg != null:
-        return "#f"
-    if arg == null:
-        return "#t"
-    return is_list(arg.cdr)
+    while isinstance(arg, Pair):
+        if isinstance(arg, VList):
+            return True
+        arg = arg.cdr
+    return arg is null
 
 
 def length(arg):
-    if is_list(arg) == "#f":
+    res, ll = 0, arg
+    while isinstance(ll, Pair):
+        if isinstance(ll, VList):
+            return res + len(ll.data)
+        res += 1
+        ll = ll.cdr
+    if ll is not null:
         raise SchemeEvaluationError(arg)
-    if arg == null:
-        return 0
-    return 1 + length(arg.cdr)
+    return res
 
 
 def get_at(ll, ind):
-    if is_list(ll) == "#f":
+    if isinstance(ind, bool):  # #f == 0 and #t == 1 in Python
+        raise SchemeEvaluationError(ind)
+    if not is_list(ll):
         if isinstance(ll, Pair) and ind == 0:
             return ll.car
         raise SchemeEvaluationError
-    if not isinstance(ind, int) or ind >= length(ll):
+    if not isinstance(ind, int) or not 0 <= ind < length(ll):
         raise SchemeEvaluationError
-    if not ind:
-        return ll.car
-    return get_at(ll.cdr, ind - 1)
-
-
-def copy_list(l1, l2):
-    if l1 == null:
-        return l2
-    return Pair(l1.car, copy_list(l1.cdr, l2))
+    while not isinstance(ll, VList):
+        if not ind:
+            return ll.car
+        ll = ll.cdr
+        ind -= 1
+    return ll.data[ind]
 
 
 def append_list(arg):
-    if not arg:
-        return null
-    if is_list(arg[0]) == "#f":
-        raise SchemeEvaluationError
-    if len(arg) == 1:
-        return copy_list(arg[0], null)
-    return copy_list(copy_list(arg[0], null), append_list(arg[1:]))
+    cars = []
+    for ll in arg:
+        if not is_list(ll):
+            raise SchemeEvaluationError
+        cars.extend(list_items(ll))
+    return make_list(cars)
 
 
 def begin(arg):
     return arg[-1]
 
 
+def memo(func):
+    """
+    Return a copy of the Scheme function func that remembers its result for
+    every tuple of arguments it is called with.  Only meant for functions
+    whose result depends on nothing but their arguments.
+    """
+    if not isinstance(func, Func):
+        raise SchemeEvaluationError(func)
+    res = Func(func.frame, func.code)
+    res.cache = {}
+    return res
+
+
 scheme_builtins = {
-    "+": sum,
-    "-": lambda args: -args[0] if len(args) == 1 else (args[0] - sum(args[1:])),
+    "+": add,
+    "-": subtract,
     "*": multiply,
     "/": divide,
-    "and": combinator,
-    "or": combinator,
-    "not": combinator,
-    "if": condition,
     "list": make_list,
     "list?": is_list,
     "length": length,
@@ -280,29 +334,98 @@ scheme_builtins = {
     "cdr": get_cdr,
     "cons": cons,
     "begin": begin,
+    "memo": memo,
+}
+scheme_builtins = {sys.intern(name): func for name, func in scheme_builtins.items()}
+
+# builtins called with their arguments spread out instead of as one list
+UNARY_BUILTINS = frozenset(
+    scheme_builtins[name] for name in ("car", "cdr", "list?", "length", "memo")
+)
+BINARY_BUILTINS = frozenset(scheme_builtins[name] for name in ("cons", "list-ref"))
+
+# two-argument arithmetic compiled to OP_ARITH2, which applies the operator
+# directly as long as the name still refers to the builtin
+ARITH2 = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
 }
 
 
 class Frame:
-    """Frame"""
+    """
+    Frame.  The parameters of a function call live in slots, in the order of
+    names; variables created with define live in the variable dict, which
+    is only created by the first define.
+    """
+
+    __slots__ = ("parent", "names", "slots", "variable")
 
-    def __init__(self, parent):
+    def __init__(self, parent, names=(), slots=()):
         self.parent = parent
-        self.variable = {}
-        self.count = 0
+        self.names = names
+        self.slots = slots
+        self.variable = None
 
     def add_var(self, name, val):
-        self.variable[name] = val
+        if name in self.names:
+            self.slots[self.names.index(name)] = val
+        else:
+            if self.variable is None:
+                self.variable = {}
+            self.variable[name] = val
+
+    def del_var(self, name):
+        if self.variable and name in self.variable:
+            return self.variable.pop(name)
+        if name in self.names:
+            ind = self.names.index(name)
+            val = self.slots[ind]
+            if val is not UNBOUND:
+                self.slots[ind] = UNBOUND
+                return val
+        raise SchemeNameError("not found")
 
     def get_var(self, name):
         if isinstance(name, (float, int)):
             raise SchemeEvaluationError
-        if name in self.variable:
-            return self.variable[name]
-        if self.parent is not None:
-            return self.parent.get_var(name)
+        if self.parent is Builtin:
+            if self.variable and name in self.variable:
+                return self.variable[name]
+            if name in scheme_builtins:
+                return scheme_builtins[name]
+            raise SchemeNameError(name)
+        frame = self
+        while frame is not None:
+            if frame.variable and name in frame.variable:
+                return frame.variable[name]
+            if name in frame.names:
+                val = frame.slots[frame.names.index(name)]
+                if val is not UNBOUND:
+                    return val
+            frame = frame.parent
         raise SchemeNameError(name)
 
+    def set_var(self, name, val):
+        frame = self
+        while frame is not None:
+            if frame.variable and name in frame.variable:
+                frame.variable[name] = val
+                return
+            if name in frame.names:
+                ind = frame.names.index(name)
+                if frame.slots[ind] is not UNBOUND:
+                    frame.slots[ind] = val
+                    return
+            frame = frame.parent
+        raise SchemeNameError(name)
+
+
+# marks a parameter slot whose variable has been removed with del
+UNBOUND = object()
+
 
 Builtin = Frame(None)
 Builtin.variable = scheme_builtins
@@ -312,18 +435,294 @@ def make_initial_frame():
     return Frame(Builtin)
 
 
+# the global frames used by evaluate and by evaluate_file when no frame is
+# given; each has its own, as the default arguments they replace did
+_DEFAULT_FRAME = make_initial_frame()
+_DEFAULT_FILE_FRAME = make_initial_frame()
+
+
 class Func:
     """Function"""
 
-    def __init__(self, frame, param, expression):
+    __slots__ = ("frame", "code", "cache")
+
+    def __init__(self, frame, code):
         self.frame = frame
-        self.param = param
-        self.myframe = None
+        self.code = code
+        self.cache = None  # dict of results by argument tuple, see memo
+
+
+############
+# Bytecode #
+############
+
+OP_CONST = 0
+OP_LOAD = 1
+OP_DEFINE = 2
+OP_DEL = 3
+OP_SET = 4
+OP_JMP = 5
+OP_JMP_IF_FALSE = 6
+OP_AND = 7
+OP_OR = 8
+OP_NOT = 9
+OP_COMPARE = 10
+OP_MAKECLOSURE = 11
+OP_CALL = 12
+OP_LOAD_LOCAL = 13
+OP_LOAD_UPVAL = 14
+OP_RETURN = 15
+OP_TAILCALL = 16
+OP_POP = 17
+OP_LOAD_GLOBAL = 18
+OP_ARITH2 = 19
+OP_SET_LOCAL = 20
+OP_SET_UPVAL = 21
+OP_SET_GLOBAL = 22
+
+
+# most frames kept for reuse per lambda; a deep recursion returns far more
+POOL_SIZE = 32
+
+
+class Code:
+    """
+    A compiled expression.  ops is a flat list of (opcode, argument) tuples;
+    constants (including the Code of nested lambdas) and symbol names are
+    referred to by their index in consts and names.
+
+    The Code of a lambda body has the Code it appears in as parent; its
+    params get the slots of the frame it runs in, and dynamic holds the
+    names its body binds with define or removes with del.
+
+    If a lambda body creates no closures, nothing can refer to the frame
+    of a call once it returns (escapes is False), so finished frames are
+    kept in pool, up to POOL_SIZE of them, and reused by later calls.
+    """
+
+    def __init__(self, params=(), parent=None, body=None):
+        self.params = tuple(params)
+        self.parent = parent
+        self.dynamic = set()
+        if body is not None:
+            find_dynamic(body, self.dynamic)
+        self.ops = []
+        self.consts = []
+        self.names = []
+        self.escapes = True
+        self.pool = []
 
-        def exp():
-            return evaluate(expression, self.myframe)
+    def emit(self, op, arg=None):
+        self.ops.append((op, arg))
+        return len(self.ops) - 1
 
-        self.expression = exp
+    def patch(self, ind, target):
+        self.ops[ind] = (self.ops[ind][0], target)
+
+    def add_const(self, value):
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def add_name(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return self.names.index(name)
+
+
+def find_dynamic(tree, names):
+    """
+    Add to names every variable that tree binds with define or removes with
+    del, without looking inside the bodies of nested lambdas and lets.
+    """
+    if not isinstance(tree, list) or not tree:
+        return
+    if tree[0] == "define":
+        if isinstance(tree[1], list):
+            names.add(tree[1][0])
+        else:
+            names.add(tree[1])
+            find_dynamic(tree[2], names)
+    elif tree[0] == "del":
+        names.add(tree[1])
+    elif tree[0] == "let":
+        for _, value in tree[1]:
+            find_dynamic(value, names)
+    elif tree[0] != "lambda":
+        for sub in tree:
+            find_dynamic(sub, names)
+
+
+def resolve(name, code):
+    """
+    Find where the variable name referred to in code lives: ("LOCAL", slot)
+    in the current frame, ("UPVAL", depth, slot) in the frame depth levels
+    up, ("DYNAMIC", name) if an enclosing lambda body may define it at run
+    time, or ("GLOBAL", depth, name) if no enclosing lambda binds it, so it
+    is looked up by name starting from the top-level frame depth levels up.
+    """
+    depth = 0
+    while code.parent is not None:
+        if name in code.dynamic:
+            return ("DYNAMIC", name)
+        if name in code.params:
+            slot = code.params.index(name)
+            return ("LOCAL", slot) if depth == 0 else ("UPVAL", depth, slot)
+        code = code.parent
+        depth += 1
+    return ("GLOBAL", depth, name)
+
+
+def compile_expr(tree, code, tail=False):
+    """
+    Emit the opcodes evaluating tree into code.  Every expression leaves
+    exactly one value on the evaluation stack.  tail is True if the value of
+    tree is returned directly from the lambda body being compiled, so a
+    call there can replace the current call instead of nesting inside it.
+    """
+    if isinstance(tree, (bool, float, int)):
+        code.emit(OP_CONST, code.add_const(tree))
+    elif isinstance(tree, str):
+        where = resolve(tree, code)
+        if where[0] == "LOCAL":
+            code.emit(OP_LOAD_LOCAL, where[1])
+        elif where[0] == "UPVAL":
+            code.emit(OP_LOAD_UPVAL, where[1:])
+        elif where[0] == "GLOBAL":
+            code.emit(OP_LOAD_GLOBAL, (where[1], code.add_name(tree)))
+        else:
+            code.emit(OP_LOAD, code.add_name(tree))
+    elif tree == []:
+        code.emit(OP_CONST, code.add_const(null))
+    elif isinstance(tree[0], str) and tree[0] in SPECIAL_FORMS:
+        SPECIAL_FORMS[tree[0]](tree, code, tail)
+    elif (
+        isinstance(tree[0], str)
+        and tree[0] in ARITH2
+        and len(tree) == 3
+        and resolve(tree[0], code)[0] == "GLOBAL"
+    ):
+        # calls are compiled here rather than in a handler of their own, so
+        # that nested calls cost one Python frame per level, not two
+        compile_expr(tree[1], code)
+        compile_expr(tree[2], code)
+        arg = (resolve(tree[0], code)[1], code.add_name(tree[0]))
+        code.emit(OP_ARITH2, arg + (scheme_builtins[tree[0]], ARITH2[tree[0]]))
+    else:
+        for sub in tree:
+            compile_expr(sub, code)
+        code.emit(OP_TAILCALL if tail else OP_CALL, len(tree) - 1)
+
+
+def compile_define(tree, code, tail):
+    if isinstance(tree[1], list):
+        compile_expr(["define", tree[1][0], ["lambda", tree[1][1:], tree[2]]], code)
+    else:
+        compile_expr(tree[2], code)
+        code.emit(OP_DEFINE, code.add_name(tree[1]))
+
+
+def compile_del(tree, code, tail):
+    code.emit(OP_DEL, code.add_name(tree[1]))
+
+
+def compile_lambda(tree, code, tail):
+    body = Code(tree[1], code, tree[2])
+    compile_expr(tree[2], body, True)
+    body.emit(OP_RETURN)
+    body.escapes = any(op == OP_MAKECLOSURE for op, _ in body.ops)
+    code.emit(OP_MAKECLOSURE, code.add_const(body))
+
+
+def compile_let(tree, code, tail):
+    names = [name for name, _ in tree[1]]
+    values = [value for _, value in tree[1]]
+    compile_expr([["lambda", names, tree[2]]] + values, code, tail)
+
+
+def compile_set(tree, code, tail):
+    compile_expr(tree[2], code)
+    where = resolve(tree[1], code)
+    if where[0] == "LOCAL":
+        code.emit(OP_SET_LOCAL, where[1])
+    elif where[0] == "UPVAL":
+        code.emit(OP_SET_UPVAL, where[1:])
+    elif where[0] == "GLOBAL":
+        code.emit(OP_SET_GLOBAL, (where[1], code.add_name(tree[1])))
+    else:
+        code.emit(OP_SET, code.add_name(tree[1]))
+
+
+def compile_compare(tree, code, tail):
+    for arg in tree[1:]:
+        compile_expr(arg, code)
+    code.emit(OP_COMPARE, (comparison[tree[0]], len(tree) - 1))
+
+
+def compile_if(tree, code, tail):
+    if len(tree) != 4:
+        raise SchemeEvaluationError(tree)
+    compile_expr(tree[1], code)
+    jump_false = code.emit(OP_JMP_IF_FALSE)
+    compile_expr(tree[2], code, tail)
+    jump_end = code.emit(OP_JMP)
+    code.patch(jump_false, len(code.ops))
+    compile_expr(tree[3], code, tail)
+    code.patch(jump_end, len(code.ops))
+
+
+def compile_begin(tree, code, tail):
+    if len(tree) == 1:
+        raise SchemeEvaluationError
+    for arg in tree[1:-1]:
+        compile_expr(arg, code)
+        code.emit(OP_POP)
+    compile_expr(tree[-1], code, tail)
+
+
+def compile_and_or(tree, code, tail):
+    op = OP_AND if tree[0] == "and" else OP_OR
+    jumps = []
+    for arg in tree[1:]:
+        compile_expr(arg, code)
+        jumps.append(code.emit(op))
+    code.emit(OP_CONST, code.add_const(tree[0] == "and"))
+    for ind in jumps:
+        code.patch(ind, len(code.ops))
+
+
+def compile_not(tree, code, tail):
+    if len(tree) != 2:
+        raise SchemeEvaluationError
+    compile_expr(tree[1], code)
+    code.emit(OP_NOT)
+
+
+# compiler for each form whose head is the given name, called as
+# handler(tree, code, tail)
+SPECIAL_FORMS = {
+    "define": compile_define,
+    "del": compile_del,
+    "lambda": compile_lambda,
+    "let": compile_let,
+    "set!": compile_set,
+    "if": compile_if,
+    "begin": compile_begin,
+    "and": compile_and_or,
+    "or": compile_and_or,
+    "not": compile_not,
+}
+SPECIAL_FORMS.update((name, compile_compare) for name in comparison)
+SPECIAL_FORMS = {sys.intern(name): func for name, func in SPECIAL_FORMS.items()}
+
+
+def compile_tree(tree):
+    """
+    Compile a fully parsed expression, as the output from the parse function,
+    into a Code object.
+    """
+    code = Code()
+    compile_expr(tree, code)
+    return code
 
 
 ##############
@@ -331,7 +730,271 @@ class Func:
 ##############
 
 
-def evaluate(tree, frame=make_initial_frame()):
+class Machine:
+    """
+    State of the dispatch loop.  code, frame and pc belong to the function
+    currently running; calls holds the (code, frame, pc, cache, key) of
+    every caller waiting for it to return, where cache and key tell where
+    to remember the result of a memoized call.  All of them share one
+    evaluation stack.
+    """
+
+    __slots__ = ("code", "ops", "frame", "pc", "stack", "calls")
+
+    def __init__(self, code, frame):
+        self.code = code
+        self.ops = code.ops
+        self.frame = frame
+        self.pc = 0
+        self.stack = []
+        self.calls = []
+
+
+def pop_args(stack, n):
+    start = len(stack) - n
+    args = stack[start:]
+    del stack[start:]
+    return args
+
+
+def call_builtin(func, args):
+    if not callable(func):
+        raise SchemeEvaluationError(func)
+    if func in BINARY_BUILTINS:
+        if len(args) != 2:
+            raise SchemeEvaluationError
+        return func(args[0], args[1])
+    if func in UNARY_BUILTINS:
+        if len(args) != 1:
+            raise SchemeEvaluationError
+        return func(args[0])
+    return func(args)
+
+
+def op_const(vm, arg):
+    vm.stack.append(vm.code.consts[arg])
+
+
+def op_load(vm, arg):
+    vm.stack.append(vm.frame.get_var(vm.code.names[arg]))
+
+
+def op_load_local(vm, arg):
+    vm.stack.append(vm.frame.slots[arg])
+
+
+def op_load_upval(vm, arg):
+    depth, slot = arg
+    frame = vm.frame
+    for _ in range(depth):
+        frame = frame.parent
+    vm.stack.append(frame.slots[slot])
+
+
+def op_load_global(vm, arg):
+    depth, ind = arg
+    frame = vm.frame
+    for _ in range(depth):
+        frame = frame.parent
+    vm.stack.append(frame.get_var(vm.code.names[ind]))
+
+
+def op_define(vm, arg):
+    vm.frame.add_var(vm.code.names[arg], vm.stack[-1])
+
+
+def op_del(vm, arg):
+    vm.stack.append(vm.frame.del_var(vm.code.names[arg]))
+
+
+def op_set(vm, arg):
+    vm.frame.set_var(vm.code.names[arg], vm.stack[-1])
+
+
+def op_set_local(vm, arg):
+    vm.frame.slots[arg] = vm.stack[-1]
+
+
+def op_set_upval(vm, arg):
+    depth, slot = arg
+    frame = vm.frame
+    for _ in range(depth):
+        frame = frame.parent
+    frame.slots[slot] = vm.stack[-1]
+
+
+def op_set_global(vm, arg):
+    depth, ind = arg
+    frame = vm.frame
+    for _ in range(depth):
+        frame = frame.parent
+    frame.set_var(vm.code.names[ind], vm.stack[-1])
+
+
+def op_jmp(vm, arg):
+    vm.pc = arg
+
+
+def op_jmp_if_false(vm, arg):
+    if vm.stack.pop() is not True:
+        vm.pc = arg
+
+
+def op_and(vm, arg):
+    if vm.stack.pop() is False:
+        vm.stack.append(False)
+        vm.pc = arg
+
+
+def op_or(vm, arg):
+    if vm.stack.pop() is True:
+        vm.stack.append(True)
+        vm.pc = arg
+
+
+def op_not(vm, arg):
+    vm.stack.append(vm.stack.pop() is False)
+
+
+def op_compare(vm, arg):
+    func, n = arg
+    if n == 2:
+        b = vm.stack.pop()
+        vm.stack[-1] = func(vm.stack[-1], b)
+    else:
+        vm.stack.append(compare(func, pop_args(vm.stack, n)))
+
+
+def op_makeclosure(vm, arg):
+    vm.stack.append(Func(vm.frame, vm.code.consts[arg]))
+
+
+def op_call(vm, arg, tail=False):
+    """
+    Call the function below the top arg values of the stack with those
+    values as arguments.  The result of a builtin is pushed right away; for
+    a Scheme function the machine switches to its code, saving the caller
+    on vm.calls unless this is a tail call.
+
+    A call to a memoized function is never treated as a tail call: its
+    entry on vm.calls carries the cache and key, and op_return stores the
+    result there.
+    """
+    start = len(vm.stack) - arg
+    args = vm.stack[start:]
+    func = vm.stack[start - 1]
+    del vm.stack[start - 1 :]
+    if not isinstance(func, Func):
+        vm.stack.append(call_builtin(func, args))
+        return
+    if len(args) != len(func.code.params):  # check num of args == num of parameter
+        raise SchemeEvaluationError
+    if func.cache is not None:
+        # with the types, #t and 1 (or 1 and 1.0) get different entries
+        key = tuple((type(val), val) for val in args)
+        if key in func.cache:
+            vm.stack.append(func.cache[key])
+            return
+        vm.calls.append((vm.code, vm.frame, vm.pc, func.cache, key))
+    elif not tail:
+        vm.calls.append((vm.code, vm.frame, vm.pc, None, None))
+    else:
+        release_frame(vm)
+    code = func.code
+    if code.pool:
+        frame = code.pool.pop()
+        frame.parent = func.frame
+        frame.slots = args
+    else:
+        frame = Frame(func.frame, code.params, args)
+    vm.code = code
+    vm.ops = code.ops
+    vm.frame = frame
+    vm.pc = 0
+
+
+def release_frame(vm):
+    """Return the frame of the function call that is finishing to its pool."""
+    if not vm.code.escapes and len(vm.code.pool) < POOL_SIZE:
+        vm.frame.variable = None
+        vm.code.pool.append(vm.frame)
+
+
+op_tailcall = functools.partial(op_call, tail=True)
+
+
+def op_arith2(vm, arg):
+    depth, ind, builtin, operation = arg
+    frame = vm.frame
+    for _ in range(depth):
+        frame = frame.parent
+    func = frame.get_var(vm.code.names[ind])
+    if func is builtin:
+        b = vm.stack.pop()
+        a = vm.stack[-1]
+        if a.__class__ is bool or b.__class__ is bool:
+            raise SchemeEvaluationError((a, b))
+        vm.stack[-1] = operation(a, b)
+    else:
+        vm.stack.insert(len(vm.stack) - 2, func)
+        op_call(vm, 2)
+
+
+def op_pop(vm, arg):
+    vm.stack.pop()
+
+
+def op_return(vm, arg):
+    release_frame(vm)
+    vm.code, vm.frame, vm.pc, cache, key = vm.calls.pop()
+    vm.ops = vm.code.ops
+    if cache is not None:
+        cache[key] = vm.stack[-1]
+
+
+DISPATCH = [
+    op_const,
+    op_load,
+    op_define,
+    op_del,
+    op_set,
+    op_jmp,
+    op_jmp_if_false,
+    op_and,
+    op_or,
+    op_not,
+    op_compare,
+    op_makeclosure,
+    op_call,
+    op_load_local,
+    op_load_upval,
+    op_return,
+    op_tailcall,
+    op_pop,
+    op_load_global,
+    op_arith2,
+    op_set_local,
+    op_set_upval,
+    op_set_global,
+]
+
+
+def execute(code, frame):
+    """
+    Run a Code object in the given frame and return the value it leaves on
+    the evaluation stack.  Calls to Scheme functions switch the machine to
+    the callee's code instead of recursing, so the depth of Scheme recursion
+    is not limited by the Python stack.
+    """
+    vm = Machine(code, frame)
+    while vm.pc < len(vm.ops):
+        op, arg = vm.ops[vm.pc]
+        vm.pc += 1
+        DISPATCH[op](vm, arg)
+    return vm.stack.pop()
+
+
+def evaluate(tree, frame=None):
     """
     Evaluate the given syntax tree according to the rules of the Scheme
     language.
@@ -339,135 +1002,70 @@ def evaluate(tree, frame=make_initial_frame()):
     Arguments:
         tree (type varies): a fully parsed expression, as the output from the
                             parse function
+        frame (Frame): the frame to evaluate in; defaults to the global
+                       frame of evaluate
     """
-    if isinstance(tree, str) and tree in {"#t", "#f"}:
-        return tree
-    if isinstance(tree, (float, int)):
-        return tree
-    if isinstance(tree, str):
-        return frame.get_var(tree)
-    if tree == []:
-        return null
-    if tree[0] == "define":
-        if isinstance(tree[1], list):
-            return evaluate(
-                ["define", tree[1][0], ["lambda", tree[1][1:], tree[2]]], frame
-            )
-        else:
-            res = evaluate(tree[2], frame)
-            frame.add_var(tree[1], res)
-            return res
-    if tree[0] == "del":
-        if tree[1] in frame.variable:
-            val = frame.variable[tree[1]]
-            del frame.variable[tree[1]]
-            return val
-        raise SchemeNameError("not found")
-    if tree[0] == "lambda":
-        func = Func(frame, tree[1], tree[2])
-        frame.add_var(tree[0], func)
-        return func
-    if tree[0] == "let":
-        new_frame = Frame(frame)
-        for name, value in tree[1]:
-            new_frame.add_var(name, evaluate(value, frame))
-        return evaluate(tree[2], new_frame)
-    if tree[0] == "set!":
-        expr = evaluate(tree[2], frame)
-        find_frame = frame
-        while tree[1] not in find_frame.variable and find_frame.parent != null:
-            find_frame = find_frame.parent
-        if tree[1] not in find_frame.variable:
-            raise SchemeNameError
-        find_frame.variable[tree[1]] = expr
-        return expr
-    if isinstance(tree[0], str) and tree[0] in comparison:
-        return compare(tree[0], tree[1:], frame)
-    if isinstance(tree[0], list):
-        frame.count += 1
-        c = frame.count
-        evaluate(["define", "()" + str(frame.count), tree[0]], frame)
-        return evaluate(["()" + str(c)] + tree[1:], frame)
-    get_func = frame.get_var(tree[0])
-    if isinstance(get_func, Func):
-        args = [
-            evaluate(tree[i], frame) for i in range(1, len(tree))
-        ]  # evaluate args in current frame
-        func_class = get_func
-        func_frame = Frame(func_class.frame)  # func_frame is new frame
-        if len(args) != len(func_class.param):  # check num of args == num pf parameter
-            raise SchemeEvaluationError
-        for name, val in zip(func_class.param, args):
-            func_frame.add_var(name, val)  # assign param name to value
-        func_class.myframe = func_frame
-        return func_class.expression()
-    if get_func in [scheme_builtins["if"]]:
-        return get_func(tree[1], tree[2], tree[3], frame)
-    if get_func in [scheme_builtins[name] for name in ["and", "or", "not"]]:
-        return get_func(tree[0], tree[1:], frame)
-    if get_func in [scheme_builtins[name] for name in ["cons", "list-ref"]]:
-        if len(tree) != 3:
-            raise SchemeEvaluationError
-        return get_func(evaluate(tree[1], frame), evaluate(tree[2], frame))
-    if get_func in [
-        scheme_builtins[name] for name in ["car", "cdr", "list?", "length"]
-    ]:
-        test_existence = [evaluate(tree[i], frame) for i in range(1, len(tree))]
-        if len(tree) != 2:
-            raise SchemeEvaluationError
-        return get_func(evaluate(tree[1], frame))
-    return get_func([evaluate(tree[i], frame) for i in range(1, len(tree))])
-
-
-def remove_space(file):
-    all_line = file.split("\n")
-    new = ""
-    def remove_comment(s):
-        new_s = ""
-        for char in s:
-            if char == ";":
-                return new_s
-            new_s += char
-        return new_s
-    return new.join(map(remove_comment, all_line))
-
-
-def get_line(code):
-    """get line from output of remove space"""
-    all_line = []
-    ob, cb = 0, 0
-    line = ""
-    in_paren = False
-    for char in code:
-        if char == "(":
-            if not in_paren and line:
-                all_line.append(line)
-                line = ""
-            line += "("
-            ob += 1
-            in_paren = True
-            continue
-        line += char
-        if char not in "()":
-            continue
-        cb += 1
-        if cb >= ob:
-            all_line.append(line)
-            line = ""
-            in_paren = False
-    return all_line
+    if frame is None:
+        frame = _DEFAULT_FRAME
+    return execute(compile_tree(tree), frame)
 
 
-def evaluate_exp(s):
-    return evaluate(parse(tokenize(s)))
+def iter_top_level_tokens(source):
+    """
+    Yield the tokens of each top-level expression in source (a whole file),
+    in order.  The source is tokenized once and the token list is cut
+    wherever the parenthesis depth returns to zero.
+    """
+    tokens = tokenize(source)
+    depth, start = 0, 0
+    for i, token in enumerate(tokens):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        if depth <= 0:
+            yield tokens[start : i + 1]
+            depth, start = 0, i + 1
+    if start < len(tokens):
+        yield tokens[start:]
+
+
+# parsed expression for every source string seen by parse_cached
+_PARSE_CACHE = {}
+
+
+def parse_cached(s):
+    res = _PARSE_CACHE.get(s)
+    if res is None:
+        res = parse(tokenize(s))
+        _PARSE_CACHE[s] = res
+    return res
+
+
+# compiled top-level expressions for every file source seen by evaluate_file.
+# Compiling does not depend on the frame (global names are found by their
+# depth from the top-level frame), so the same Code serves any frame.
+_FILE_CACHE = {}
 
 
-def evaluate_file(file_name, frame=make_initial_frame()):
-    file = open(file_name, "r").read()
-    all_line = get_line(remove_space(file))
+def evaluate_exp(s):
+    return evaluate(parse_cached(s))
+
+
+def evaluate_file(file_name, frame=None):
+    if frame is None:
+        frame = _DEFAULT_FILE_FRAME
+    with open(file_name, "r") as file:
+        source = file.read()
+    codes = _FILE_CACHE.get(source)
+    if codes is None:
+        codes = [
+            compile_tree(parse(tokens)) for tokens in iter_top_level_tokens(source)
+        ]
+        _FILE_CACHE[source] = codes
     res = None
-    for line in all_line:
-        res = evaluate(parse(tokenize(line)), frame)
+    for code in codes:
+        res = execute(code, frame)
     return res
 
 ###########
@@ -491,3 +1089,20 @@ print(file_3) # 10
 
 file_4 = evaluate_file("test4.txt")
 print(file_4) # 15
+
+# a frame of their own, so these checks leave nothing behind in the global
+# frame of evaluate
+checks = make_initial_frame()
+
+
+def check(s):
+    return evaluate(parse_cached(s), checks)
+
+
+same = check("(list (equal? #t 1) (equal? #f 0) (equal? #t #t) (equal? 1 1.0))")
+print(list_items(same)) # [False, False, True, True]
+
+check("(define f (memo (lambda (x) (if x 10 20))))")
+check("(define g (memo (lambda (x) (+ x 0))))")
+print(check("(f 1)"), check("(f #t)")) # 20 10
+print(check("(g 1)"), check("(g 1.0)")) # 1 1.0